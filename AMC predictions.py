@@ -6,41 +6,159 @@ Created on Tue Jun  3 19:02:44 2025
 @author: mariabucheru
 """
 
+import os
+import multiprocessing
+import tempfile
+
 import numpy as np
+import scipy.linalg
+from scipy.spatial.distance import squareform
 from pymol import cmd
 import matplotlib.pyplot as plt
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 objects = cmd.get_object_list()
 print(objects)
 
-for i in objects: print(i)
-for idx, obj1 in enumerate(objects): print(idx, obj1)
-for idx, obj1 in enumerate(objects):
-    for obj2 in objects[idx+1:]: print(idx, obj1, obj2)
-print(obj1, obj2)
-print(cmd.align(objects[0], objects[1], cycles=0))
+# Each worker runs its own headless PyMOL instance and loads the structures
+# once from disk, so the N*(N-1)/2 align calls run in parallel.
+_worker_objects = None
+
+
+def _init_worker(pdb_paths):
+    import pymol
+    pymol.finish_launching(['pymol', '-cq'])
+
+    # Feedback serializes on stdout for every command; silence it once
+    pymol.cmd.feedback('disable', 'all', 'everything')
+
+    # Pre-create CA-only copies so each align call works on a small fixed
+    # object instead of re-deriving the selection from the full structure
+    global _worker_objects
+    _worker_objects = []
+    for obj, path in pdb_paths:
+        pymol.cmd.load(path, obj)
+        pymol.cmd.create(obj + '_ca', obj + ' and name CA')
+        pymol.cmd.delete(obj)
+        _worker_objects.append(obj + '_ca')
+
+
+def _align_pair(pair):
+    from pymol import cmd as wcmd
+    i, j = pair
+    return wcmd.align(_worker_objects[i], _worker_objects[j], cycles=0)[3]
+
+
+def pairwise_align_rmsd(objects, ncpu=None):
+    '''
+    Align every pair of loaded objects and return the pairwise RMSDs,
+    dispatching the pairs over a pool of PyMOL worker processes.
+    '''
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pdb_paths = [(obj, os.path.join(tmpdir, f'{obj}.pdb')) for obj in objects]
+        for obj, path in pdb_paths:
+            cmd.save(path, obj)
+
+        pairs = [(i, j) for i in range(len(objects)) for j in range(i + 1, len(objects))]
+        with multiprocessing.Pool(ncpu, initializer=_init_worker, initargs=(pdb_paths,)) as pool:
+            rmsds = pool.map(_align_pair, pairs)
+    return np.fromiter(rmsds, dtype=np.float32, count=len(pairs))
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _pairwise_rmsd_jit(X, G, out):
+        n, L = X.shape[0], X.shape[1]
+        for p in prange(n):
+            for q in range(p + 1, n):
+                H = np.ascontiguousarray(X[p].T) @ X[q]
+                U, S, Vt = np.linalg.svd(H)
+                d = np.sign(np.linalg.det(U @ Vt))
+                D = S[0] + S[1] + d * S[2]
+                out[p, q] = out[q, p] = np.sqrt(max((G[p] + G[q] - 2 * D) / L, 0))
+
+
+def _pairwise_rmsd_numpy(X, G, out):
+    # H[n, m] = X[n].T @ X[m]; batched 3x3 SVDs give the Kabsch RMSDs
+    L = X.shape[1]
+    H = np.einsum('nij,mik->nmjk', X, X)
+    U, S, Vt = np.linalg.svd(H)
+    S[..., 2] *= np.sign(np.linalg.det(U @ Vt))
+    D2 = (G[:, None] + G[None, :] - 2 * S.sum(axis=-1)) / L
+    out[:] = np.sqrt(np.maximum(D2, 0))
+
+
+def pairwise_kabsch_rmsd(objects):
+    '''
+    Compute all pairwise CA RMSDs with a vectorized Kabsch kernel.
+
+    The CA coordinates of each object are extracted once and centered; the
+    3x3 covariance plus tiny SVD of every pair then gives the optimally
+    superposed RMSDs. When numba is available the pair loop runs as a
+    parallel JIT kernel (the tiny 3x3 problems batch poorly in NumPy),
+    otherwise a batched einsum/SVD fallback is used.
+    '''
+    coords = [cmd.get_coords(obj + ' and name CA') for obj in objects]
+    lengths = {len(c) for c in coords}
+    if len(lengths) != 1:
+        raise ValueError(f'objects differ in CA count ({sorted(lengths)}); '
+                         'use pairwise_align_rmsd instead')
+
+    X = np.stack(coords).astype(np.float64)
+    X -= X.mean(axis=1, keepdims=True)
+    G = (X ** 2).sum(axis=(1, 2))
+
+    rmsd = np.zeros((len(objects), len(objects)), dtype=np.float32)
+    kernel = _pairwise_rmsd_jit if njit is not None else _pairwise_rmsd_numpy
+    kernel(X, G, rmsd)
+    return rmsd[np.triu_indices(len(objects), 1)]
+
+
+def pairwise_coord_rmsd(objects):
+    '''
+    Pairwise CA RMSDs for pre-superposed structures via the Gram identity
+    ||X - Y||^2 = ||X||^2 + ||Y||^2 - 2 X.Y, so the whole matrix comes out
+    of a single GEMM at BLAS speed. Use pairwise_kabsch_rmsd when the
+    objects still need superposing.
+    '''
+    C = np.stack([cmd.get_coords(obj + ' and name CA').ravel() for obj in objects])
+    L = C.shape[1] // 3
+
+    sq = (C * C).sum(axis=1)
+    D2 = sq[:, None] + sq[None, :] - 2 * (C @ C.T)
+    rmsd = np.sqrt(np.maximum(D2, 0) / L)
+    return rmsd[np.triu_indices(len(objects), 1)]
+
 
 import time
-print(-time.time() + (cmd.align(objects[0], objects[1], cycles=0) and time.time()))
-
-alignments = []
-for idx, obj1 in enumerate(objects):
-    for obj2 in objects[idx+1:]:
-        print(obj1, obj2, -time.time() + (alignments.append(cmd.align(obj1, obj2)) or time.time()))
-print(alignments)
-
-A= np.zeros((len (objects), len(objects)))
-A[np.triu_indices(len(objects),1) ]= [aln[3] for aln in alignments]
-A += A.T
-print (A)
+start = time.time()
+rmsds = pairwise_kabsch_rmsd(objects)
+print(f'{len(rmsds)} pairwise RMSDs in {time.time() - start:.3f}s')
+
+# rmsds stays in condensed (upper-triangle) form; densify exactly once
+# for the heatmap and the MDS step below
+A = squareform(rmsds)
+print(A)
 plt.imshow(A)
 plt.show(A)
 
+# Double-center A in place for classical MDS instead of allocating the
+# N x N temporaries of -0.5 * (A - m[:,None] - m[None,:] + m.mean())
 m = A.mean(axis=0)
-vals, vecs = np.linalg.eigh(-0.5 * (A - m[:,None] - m[None,:] + m.mean()))
+A -= m[None, :]
+A -= m[:, None]
+A += m.mean()
+A *= -0.5
+
+# Only the top three eigenpairs are plotted, so skip the full spectrum
+vals, vecs = scipy.linalg.eigh(A, subset_by_index=[len(A) - 3, len(A) - 1])
 print(vals)
-pcoords = vecs[:, ::-1] * vals[::-1] **0.5
+pcoords = vecs[:, ::-1] * np.maximum(vals[::-1], 0) **0.5
 
 plt.scatter(pcoords[:, 0], pcoords[:, 1])
 plt.gca().set_aspect('equal')
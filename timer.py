@@ -2,13 +2,20 @@ import time
 
 
 class Timer(list):
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Entries still waiting for their end time, innermost last
+        self._stack = []
+
     def __call__(self, msg=None, nopar=False):
-                    
+
         # With a message, run as context
         if msg is not None:
-            self.append([msg, time.time()])
+            entry = [msg, time.perf_counter()]
+            self.append(entry)
+            self._stack.append(entry)
             return self
-        
+
         # Without a message, run as decorator
         def inner(func):
             run = [0]
@@ -20,21 +27,25 @@ class Timer(list):
                     return func(*args, **kwargs)
             return wrapper
         return inner
-        
+
     def __repr__(self):
         if not hasattr(self, 'idx'):
-            self.idx = 0    
-        out = '\n'.join(f'{lbl}: {e-s:.6f}s' for lbl, s, e in self[self.idx:])
-        self.idx = len(self)
-        
+            self.idx = 0
+
+        # Report up to the first entry that is still open; anything after
+        # it is held back until that enclosing context closes as well
+        done = self.idx
+        while done < len(self) and len(self[done]) == 3:
+            done += 1
+        out = '\n'.join(f'{lbl}: {e-s:.6f}s' for lbl, s, e in self[self.idx:done])
+        self.idx = done
+
         return out
-    
+
     def __enter__(self):
         pass
-    
+
     def __exit__(self, exc_type, exc_value, exc_tb):
-        for item in self[::-1]:
-            if len(item) == 2:
-                item.append(time.time())
-                break
+        if self._stack:
+            self._stack.pop().append(time.perf_counter())
         print(self)
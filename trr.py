@@ -1,6 +1,22 @@
+import os
 import sys
+import zipfile
 import numpy as np
-from struct import unpack
+from concurrent.futures import ThreadPoolExecutor
+from struct import Struct, error
+
+
+# Precompiled header formats; Struct.unpack skips re-parsing the format
+# string, which adds up over trajectories with many frames
+_HDR = Struct('>13l')
+_TAIL_F = Struct('>2f')
+_TAIL_D = Struct('>2d')
+
+# The same fixed layout as a NumPy dtype, so uniform trajectories can be
+# indexed with one strided pass over a memory map instead of per-frame
+# unpacking in Python
+_HDR_DTYPE_F = np.dtype([('tag', 'S24'), ('sizes', '>i4', 13), ('tail', '>f4', 2)])
+_HDR_DTYPE_D = np.dtype([('tag', 'S24'), ('sizes', '>i4', 13), ('tail', '>f8', 2)])
 
 
 class TRRHeader:
@@ -45,7 +61,7 @@ class TRRHeader:
         #       76
         header = stream.read(76)
         self.tag = header[:8]
-        self._rawheader = list(unpack('>lllllllllllll', header[24:]))
+        self._rawheader = list(_HDR.unpack(header[24:]))
         self.step = self._rawheader[-2]
 
         # Deatermine if real is single or double precision
@@ -56,10 +72,8 @@ class TRRHeader:
         # 20    80/84  f - Lambda
         #       84/92
 
-        if self.double:
-            self._rawheader.extend(unpack('>dd', stream.read(16)))
-        else:
-            self._rawheader.extend(unpack('>ff', stream.read(8)))
+        tail = _TAIL_D if self.double else _TAIL_F
+        self._rawheader.extend(tail.unpack(stream.read(tail.size)))
 
         self.positions = self._rawheader[7]
         self.velocities = self._rawheader[8]
@@ -70,8 +84,47 @@ class TRRHeader:
         
         self.fsize = sum(self._rawheader[:10]) # Including box, x, v, f
         self.bsize = max(self._rawheader[7:10])  # Size of block (x, v, or f)
-        self.hsize = 164 if self.double else 120 
-        
+        self.hsize = 164 if self.double else 120
+
+    @classmethod
+    def parse_minimal(cls, stream):
+        """
+        Decode only the fields needed to index a frame, skipping the
+        attribute assignments of a full TRRHeader.
+
+        Args:
+            stream (file-like): Open binary stream positioned at the start of a .trr frame.
+
+        Returns:
+            tuple: (fsize, hsize, time, positions, velocities, forces, natoms).
+        """
+        raw = _HDR.unpack(stream.read(76)[24:])
+        double = (max(raw[-6:-3]) // raw[-3] // 3) == 8
+        tail = _TAIL_D if double else _TAIL_F
+        time = tail.unpack(stream.read(tail.size))[0]
+        return (sum(raw[:10]), 164 if double else 120, time,
+                raw[7], raw[8], raw[9], raw[10])
+
+
+class _Headers:
+    """
+    Sequence proxy that builds a full TRRHeader on demand.
+
+    The TRR class keeps per-frame header fields in NumPy arrays rather than
+    one Python object per frame; indexing this proxy re-parses the requested
+    frame's header from the file for code that needs the full object.
+    """
+
+    def __init__(self, trr):
+        self._trr = trr
+
+    def __len__(self):
+        return len(self._trr.frames)
+
+    def __getitem__(self, i):
+        self._trr.trr.seek(int(self._trr.frames[i]), 0)
+        return TRRHeader(self._trr.trr)
+
 
 class TRR:
     """
@@ -79,8 +132,8 @@ class TRR:
 
     Attributes:
         trr (file): Open .trr file in binary mode.
-        frames (list): Byte positions of each frame in the file.
-        headers (list): TRRHeader objects for each frame.
+        frames (np.ndarray): Byte positions of each frame in the file.
+        headers (_Headers): Per-frame TRRHeader objects, parsed on demand.
     """
 
     def __init__(self, filename, selection=slice(None)):
@@ -95,80 +148,198 @@ class TRR:
 
         Attributes:
             trr (file): Open binary file handle.
-            frames (list of int): Byte offsets of each frame in the file.
-            headers (list of TRRHeader): Parsed headers for each frame.
+            frames (np.ndarray): Byte offsets of each frame in the file.
+            headers (_Headers): Full headers, re-parsed per frame on demand.
             natoms (int): Total number of atoms in the system.
             selection: The provided atom selection.
             _maxidx (int): Highest atom index accessed, inferred from selection.
         """
         self.filename = filename
         self.trr = open(filename, 'rb')
-        
-        size = self.trr.seek(0, 2) and self.trr.tell()
-        frames = []
-        self.headers = []
-        
-        # Read the positions of the frames and the corresponding headers
-        pos = 0                
-        while pos < size:
-            self.trr.seek(pos, 0)
-            frames.append(pos)
-            self.headers.append(TRRHeader(self.trr))
-            pos += self.headers[-1].fsize + self.headers[-1].hsize - 36 # No box?
-
-        self.frames = np.array(frames)
-        self.times = np.array([ h.time for h in self.headers ])
-        
-        # These are the sizes of each section per frame
-        self._sizes = np.array([ 
-            (h.positions, h.velocities, h.forces)
-            for h in self.headers 
-        ]).T
+
+        stat = os.stat(filename)
+        size = stat.st_size
+
+        # Re-use a cached index if the file hasn't changed since it was built,
+        # so re-opening a huge trajectory skips the header pass entirely
+        cache = filename + '.idx.npz'
+        cached = None
+        if os.path.exists(cache):
+            try:
+                idx = np.load(cache)
+                if idx['mtime'] == stat.st_mtime and idx['size'] == size:
+                    cached = idx
+            except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+                pass # Truncated or foreign cache; index again below
+
+        if cached is not None:
+            frames = cached['frames']
+            self.times = cached['times']
+            self._sizes = cached['sizes']
+            self._hsize = int(cached['hsize'])
+            natoms = int(cached['natoms'])
+        else:
+            # Frame 0 sets the expected stride; in a uniform trajectory every
+            # offset then follows from one arange instead of a positional walk
+            self.trr.seek(0, 0)
+            first = TRRHeader.parse_minimal(self.trr)
+            stride = first[0] + first[1] - 36 # No box?
+            self._hsize = first[1]
+
+            nframes = size // stride
+            if nframes and size % stride == 0:
+                frames = np.arange(nframes) * stride
+                # Validate magic and stride at the probed offset before
+                # trusting it; a mixed-layout file whose size is a multiple
+                # of frame 0's stride lands this probe mid-frame on garbage
+                self.trr.seek(frames[-1], 0)
+                magic = self.trr.read(4)
+                self.trr.seek(frames[-1], 0)
+                try:
+                    last = TRRHeader.parse_minimal(self.trr)
+                    if (int.from_bytes(magic, 'big') != 1993
+                            or last[0] + last[1] - 36 != stride):
+                        frames = None
+                except (ZeroDivisionError, error):
+                    frames = None
+            else:
+                frames = None
+
+            if frames is not None:
+                # Decode all headers in one strided structured-array pass over
+                # a memory map; NumPy does the unpacking in a single C loop
+                mm = np.memmap(filename, dtype=np.uint8, mode='r')
+                dtype = _HDR_DTYPE_D if self._hsize == 164 else _HDR_DTYPE_F
+                hdrs = np.ndarray(nframes, dtype=dtype, buffer=mm, strides=(stride,))
+                raw = hdrs['sizes'].astype(np.int64)
+                self.times = hdrs['tail'][:, 0].astype(np.float64)
+                self._sizes = raw[:, 7:10]
+                natoms = int(raw[0, 10])
+            else:
+                # Stride varies between frames; walk the file frame by frame
+                index, frames, pos = [first], [0], stride
+                while pos < size:
+                    self.trr.seek(pos, 0)
+                    frames.append(pos)
+                    index.append(TRRHeader.parse_minimal(self.trr))
+                    pos += index[-1][0] + index[-1][1] - 36
+                frames = np.array(frames)
+                index = np.array(index)
+                self.times = index[:, 2]
+                self._sizes = index[:, 3:6].astype(np.int64)
+                natoms = int(index[0, 6])
+
+            try:
+                np.savez(cache, mtime=stat.st_mtime, size=size, frames=frames,
+                         times=self.times, sizes=self._sizes,
+                         hsize=self._hsize, natoms=natoms)
+            except OSError:
+                pass # Read-only location; index again next time
+
+        self.frames = frames
         self._have = self._sizes.astype(bool)
-        
-        # Determine the positions of each section in each frame (if present)
-        self._starts = np.zeros_like(self._have) + frames + self.headers[0].hsize
-        self._starts[1:] += self._sizes[0]
-        self._starts[2] += self._sizes[1]
-                     
-        self.natoms = self.headers[0].natoms
+
+        # Explicit int64 byte offsets of each section in each frame
+        self._starts = np.empty((len(frames), 3), dtype=np.int64)
+        self._starts[:, 0] = frames + self._hsize
+        self._starts[:, 1] = self._starts[:, 0] + self._sizes[:, 0]
+        self._starts[:, 2] = self._starts[:, 1] + self._sizes[:, 1]
+
+        self.natoms = natoms
+        self.headers = _Headers(self)
+        self._cache = {}
         self.selection = selection
         
         # Determine the maximum atom index to read from the selection
         self._maxidx = self.natoms
+        self._runs = None
         if isinstance(selection, int):
             self._maxidx = min(selection, self._maxidx)
             self.selection = slice(0, selection)
         elif isinstance(selection, slice):
             if selection.stop is not None:
                 self._maxidx = min(selection.stop, self._maxidx)
-        elif isinstance(selection, np.ndarray):
-            if selection.dtype == bool:
-                self._maxidx = np.where(selection)[0][-1]
-            else:
-                self._maxidx = max(selection) + 1
-        elif isinstance(selection, (list, tuple)):
-            selmax = max(selection) + 1
-            if selmax > 2:
-                self._maxidx = selmax
-            else:
-                self._maxidx = np.where(selection)[0][-1]
+        else:
+            idx = np.asarray(selection)
+            # Boolean masks become index arrays; integer arrays are always
+            # indices. Only lists/tuples of 0/1 values keep being read as
+            # masks, matching the original heuristic
+            if idx.dtype == bool:
+                idx = np.where(idx)[0]
+            elif isinstance(selection, (list, tuple)) and max(selection) + 1 <= 2:
+                idx = np.where(idx)[0]
+            self._maxidx = min(int(idx.max()) + 1, self._maxidx)
+            self.selection = idx
+            # For sparse sorted selections, read only the contiguous runs
+            # of selected atoms instead of everything up to the last one
+            if 2 * len(idx) <= self._maxidx and np.all(np.diff(idx) > 0):
+                runs = np.split(idx, np.where(np.diff(idx) > 1)[0] + 1)
+                self._runs = [(int(r[0]), len(r)) for r in runs]
     
-    def _read(self, k):
+    def _read_frame(self, fd, X, pos):
+        """
+        Read one frame's block at byte offset pos into the row X,
+        honoring the precomputed selection runs when present.
+
+        Raises:
+            EOFError: If the file yields fewer bytes than the block needs,
+                e.g. for the truncated final frame of a crashed run.
+        """
+        if self._runs is not None:
+            at = 0
+            for first, natoms in self._runs:
+                run = X[at:at + natoms]
+                if os.preadv(fd, [run], pos + 12 * first) != run.nbytes:
+                    raise EOFError(f'truncated block at byte {pos} of {self.filename}')
+                at += natoms
+        else:
+            if os.preadv(fd, [X], pos) != X.nbytes:
+                raise EOFError(f'truncated block at byte {pos} of {self.filename}')
+
+    def _read_all(self, kinds=(0, 1, 2)):
         """
-        Read a data block (coordinates, velocities, or forces) for all available frames.
+        Read one or more block types in a single pass over the file, walking
+        the frames in file order so each frame's blocks are read together.
+        Results are kept in a shared cache, so each block is read only once.
 
         Args:
-            k (int): Index of the block type to read (0 = coordinates, 1 = velocities, 2 = forces).
+            kinds (iterable of int): Block types to read (0 = coordinates,
+                1 = velocities, 2 = forces).
 
         Returns:
-            np.ndarray: Array of shape (n_frames, n_atoms, 3) containing the requested data.
+            dict: Maps each requested block type to a float32 array of
+                shape (n_frames, n_atoms, 3).
         """
-        X = np.zeros((sum(self._have[k]), self._maxidx, 3))
-        for frame, pos in enumerate(self._starts[k, self._have[k]]):
-            self.trr.seek(pos)
-            X[frame] = np.fromfile(self.trr, dtype='>f4', count=3*self._maxidx).reshape((-1, 3))
-        return X[:, self.selection]
+        todo = sorted(k for k in kinds if k not in self._cache)
+        natoms = len(self.selection) if self._runs is not None else self._maxidx
+
+        # Output is float32 end-to-end; TRR stores single precision anyway
+        out = {k: np.empty((int(self._have[:, k].sum()), natoms, 3), dtype=np.float32)
+               for k in todo}
+        rows = dict.fromkeys(todo, 0)
+
+        fd = self.trr.fileno()
+        tasks = []
+        for frame in range(len(self.frames)):
+            for k in todo:
+                if self._have[frame, k]:
+                    tasks.append((out[k][rows[k]], self._starts[frame, k]))
+                    rows[k] += 1
+
+        # pread releases the GIL, so issuing the frame reads from a thread
+        # pool keeps several requests in flight and hides IO latency
+        if len(tasks) > 1:
+            with ThreadPoolExecutor(min(8, len(tasks))) as pool:
+                list(pool.map(lambda task: self._read_frame(fd, *task), tasks))
+        else:
+            for X, pos in tasks:
+                self._read_frame(fd, X, pos)
+
+        for k in todo:
+            # The raw bytes are big-endian; swap them in place via a uint32 view
+            out[k].view(np.uint32).byteswap(inplace=True)
+            self._cache[k] = out[k] if self._runs is not None else out[k][:, self.selection]
+        return {k: self._cache[k] for k in kinds}
 
     @property
     def positions(self):
@@ -176,11 +347,9 @@ class TRR:
         np.ndarray: Lazily loaded array of atomic positions for each frame.
 
         Returns:
-            np.ndarray of shape (n_frames, n_atoms, 3).
+            np.ndarray of shape (n_frames, n_atoms, 3), dtype float32.
         """
-        if not hasattr(self, '_positions'):
-            self._positions = self._read(0)
-        return self._positions
+        return self._read_all((0,))[0]
 
     @property
     def velocities(self):
@@ -188,11 +357,9 @@ class TRR:
         np.ndarray: Lazily loaded array of atomic velocities for each frame.
 
         Returns:
-            np.ndarray of shape (n_frames, n_atoms, 3).
+            np.ndarray of shape (n_frames, n_atoms, 3), dtype float32.
         """
-        if not hasattr(self, '_velocities'):
-            self._velocities = self._read(1)
-        return self._velocities
+        return self._read_all((1,))[1]
 
     @property
     def forces(self):
@@ -200,11 +367,9 @@ class TRR:
         np.ndarray: Lazily loaded array of atomic forces for each frame.
 
         Returns:
-            np.ndarray of shape (n_frames, n_atoms, 3).
+            np.ndarray of shape (n_frames, n_atoms, 3), dtype float32.
         """
-        if not hasattr(self, '_forces'):
-            self._forces = self._read(2)
-        return self._forces
+        return self._read_all((2,))[2]
 
     
 if __name__ == '__main__':